@@ -21,6 +21,7 @@ class Settings:
     RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "1000"))
     RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "100"))
     EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
     RAG_DOWNLOAD_K = int(os.getenv("RAG_DOWNLOAD_K", "20"))
     RAG_RETRIEVAL_K = int(os.getenv("RAG_RETRIEVAL_K", "15"))
 
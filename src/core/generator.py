@@ -1,6 +1,6 @@
 import json
 import os
-from typing import List, Union, Dict
+from typing import Iterator, List, Union, Dict
 from src.core.llm import LLMService
 from src.utils.logger import setup_logger
 
@@ -62,18 +62,14 @@ class ReviewGenerator:
         
         return formatted_text
 
-    def generate(self, user_query: str, context_data: Union[List[str], List[Dict]], task_type: str = "review") -> str:
+    def _build_prompt(self, user_query: str, context_data: Union[List[str], List[Dict]], task_type: str):
         """
-        生成回复
-        :param user_query: 用户问题
-        :param context_data: 上下文数据 (chunk 列表或 paper 字典列表)
-        :param task_type: 任务类型 (review/explain/inspire)
+        组装最终 Prompt
+        :return: (full_prompt, None)；无法组装时返回 (None, 提示信息)
         """
-        self.logger.info(f"Generating response. Mode: {task_type}")
-        
         # 即使数据为空，也尝试让 LLM 回答（可能会利用其自身知识），或者返回提示
         if not context_data:
-            return "未找到相关背景知识，无法生成回答。"
+            return None, "未找到相关背景知识，无法生成回答。"
 
         # 1. 获取对应的 Prompt 配置
         task_config = self.prompts["tasks"].get(task_type, self.prompts["tasks"]["review"])
@@ -92,7 +88,32 @@ class ReviewGenerator:
             )
         except KeyError as e:
             self.logger.error(f"Prompt template missing key: {e}")
-            return "Error constructing prompt."
+            return None, "Error constructing prompt."
+        return full_prompt, None
+
+    def generate(self, user_query: str, context_data: Union[List[str], List[Dict]], task_type: str = "review") -> str:
+        """
+        生成回复
+        :param user_query: 用户问题
+        :param context_data: 上下文数据 (chunk 列表或 paper 字典列表)
+        :param task_type: 任务类型 (review/explain/inspire)
+        """
+        self.logger.info(f"Generating response. Mode: {task_type}")
+        full_prompt, fallback = self._build_prompt(user_query, context_data, task_type)
+        if full_prompt is None:
+            return fallback
 
         # 4. 调用 LLM
-        return self.llm.chat("You are a helpful research assistant.", full_prompt)
\ No newline at end of file
+        return self.llm.chat("You are a helpful research assistant.", full_prompt)
+
+    def generate_stream(self, user_query: str, context_data: Union[List[str], List[Dict]], task_type: str = "review") -> Iterator[str]:
+        """
+        流式生成回复，参数同 generate，逐段 yield 文本
+        """
+        self.logger.info(f"Generating streamed response. Mode: {task_type}")
+        full_prompt, fallback = self._build_prompt(user_query, context_data, task_type)
+        if full_prompt is None:
+            yield fallback
+            return
+
+        yield from self.llm.chat_stream("You are a helpful research assistant.", full_prompt)
@@ -30,4 +30,25 @@ class LLMService:
         except Exception as e:
             error_msg = f"LLM Call Failed: {str(e)}"
             self.logger.error(error_msg)
-            return error_msg
\ No newline at end of file
+            return error_msg
+
+    # 流式接口：逐段 yield 增量文本，首个 token 到达即可开始渲染
+    def chat_stream(self, system_prompt, user_prompt):
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=settings.LLM_TEMPERATURE, 
+                max_tokens=settings.LLM_MAX_TOKENS,
+                stream=True
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            error_msg = f"LLM Call Failed: {str(e)}"
+            self.logger.error(error_msg)
+            yield error_msg
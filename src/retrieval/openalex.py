@@ -140,7 +140,7 @@ class OpenAlexRetriever(BaseRetriever):
                 arxiv_url = ids.get("arxiv")
                 if arxiv_url:
                     pdf_url = arxiv_url.replace("/abs/", "/pdf/") + ".pdf"
-                    self.logger.info(f"🔗 Recovered ArXiv PDF for {work['id']}: {pdf_url}")
+                    self.logger.info("🔗 Recovered ArXiv PDF for %s: %s", work['id'], pdf_url)
 
             papers.append({
                 "id": work["id"],
@@ -159,10 +159,14 @@ class OpenAlexRetriever(BaseRetriever):
         # Debug 输出
         debug_path = os.path.join("data", "papers_debug.txt")
         os.makedirs("data", exist_ok=True) 
+        # 先拼好整份报告，再一次性写入文件
+        report = "".join(
+            f"[{'✅ Has PDF' if p['pdf_url'] else '❌ No PDF'}] {p['id']} | {p['title']}\n"
+            f"URL: {p['url']}\nPDF: {p['pdf_url']}\n{'-'*30}\n"
+            for p in papers
+        )
         with open(debug_path, "w", encoding="utf-8") as f:
-            for p in papers:
-                status = "✅ Has PDF" if p['pdf_url'] else "❌ No PDF"
-                f.write(f"[{status}] {p['id']} | {p['title']}\nURL: {p['url']}\nPDF: {p['pdf_url']}\n{'-'*30}\n")
+            f.write(report)
         self.logger.info(f"Saved metadata to {debug_path}")
 
         return papers
\ No newline at end of file
@@ -1,203 +1,414 @@
-import os
-import re
-import requests
-import fitz
-import chromadb
-from chromadb import Documents, EmbeddingFunction, Embeddings
-from tqdm import tqdm
-from src.utils.logger import setup_logger
-from src.config import settings  # <--- 引入配置
-import openai
-import warnings
-from urllib3.exceptions import InsecureRequestWarning
-
-warnings.simplefilter('ignore', InsecureRequestWarning)
-
-# --- 1. 修改 Embedding 函数，支持配置化的 Batch Size ---
-class SiliconFlowEmbeddingFunction(EmbeddingFunction):
-    def __init__(self, api_key: str, base_url: str, model_name: str, batch_size: int = 32):
-        self.client = openai.OpenAI(api_key=api_key, base_url=base_url)
-        self.model_name = model_name
-        self.batch_size = batch_size  # <--- 从配置接收 batch_size
-
-    def __call__(self, input: Documents) -> Embeddings:
-        input = [text.replace("\n", " ") for text in input]
-        all_embeddings = []
-
-        # 使用配置中的 self.batch_size
-        for i in range(0, len(input), self.batch_size):
-            batch = input[i : i + self.batch_size]
-            try:
-                response = self.client.embeddings.create(
-                    input=batch,
-                    model=self.model_name
-                )
-                batch_embeddings = [data.embedding for data in response.data]
-                all_embeddings.extend(batch_embeddings)
-            except Exception as e:
-                print(f"❌ Embedding API Error at batch {i}: {e}")
-                raise e
-        return all_embeddings
-
-# --- 2. 修改主类，应用 Chunk 参数 ---
-class LocalVectorStore:
-    def __init__(self, persist_dir="data/vector_store"):
-        self.logger = setup_logger("VectorStore")
-        self.pdf_dir = "data/cache/pdfs"
-        
-        os.makedirs(self.pdf_dir, exist_ok=True)
-        os.makedirs(persist_dir, exist_ok=True)
-
-        self.client = chromadb.PersistentClient(path=persist_dir)
-        
-        self.logger.info(f"Init Embedding: {settings.EMBEDDING_MODEL_NAME} | Batch: {settings.EMBEDDING_BATCH_SIZE}")
-        
-        # [修改] 传入配置的 batch_size
-        self.ef = SiliconFlowEmbeddingFunction(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_BASE_URL,
-            model_name=settings.EMBEDDING_MODEL_NAME,
-            batch_size=settings.EMBEDDING_BATCH_SIZE
-        )
-        
-        self.collection = self.client.get_or_create_collection(
-            name="research_papers",
-            embedding_function=self.ef
-        )
-
-    def _sanitize_filename(self, title):
-        clean_name = re.sub(r'[\\/*?:"<>|]', "", title)
-        clean_name = " ".join(clean_name.split())
-        return clean_name[:50]
-
-    def _download_pdf(self, url, paper_id, title):
-        """下载 PDF (带详细 Debug)"""
-        if not url:
-            return None
-        
-        safe_title = self._sanitize_filename(title)
-        short_id = paper_id.split("/")[-1]
-        file_name = f"{short_id}_{safe_title}.pdf"
-        save_path = os.path.join(self.pdf_dir, file_name)
-        
-        if os.path.exists(save_path):
-            return save_path
-
-        try:
-            # 稍微增强一点 Headers，模拟真实浏览器
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'application/pdf,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Connection': 'keep-alive',
-                'Referer': 'https://scholar.google.com/' 
-            }
-            # verify=False 解决证书问题，stream=True 优化大文件下载
-            response = requests.get(url, headers=headers, timeout=20, verify=False, stream=True)
-            
-            # [新增] 检查状态码，如果不是 200，主动抛出异常以便被 except 捕获并打印
-            if response.status_code != 200:
-                raise ValueError(f"HTTP {response.status_code}")
-
-            with open(save_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            return save_path
-
-        except Exception as e:
-            # [新增] 打印具体的 URL 和错误原因，方便你排查
-            self.logger.warning(f"⚠️ Download Failed: {str(e)} | URL: {url}")
-            # 如果是 IEEE 这种反爬严重的，这里会打印 HTTP 418 或 403
-            return None
-
-    def _parse_pdf(self, pdf_path):
-        if not pdf_path: return ""
-        try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            return text
-        except Exception as e:
-            self.logger.error(f"PDF parse error: {e}")
-            return ""
-
-    # [关键修改] 让 _chunk_text 读取配置参数
-    def _chunk_text(self, text):
-        """使用 .env 配置进行切片"""
-        chunk_size = settings.RAG_CHUNK_SIZE
-        overlap = settings.RAG_CHUNK_OVERLAP
-        
-        if not text: return []
-        chunks = []
-        # 滑动窗口切片逻辑
-        for i in range(0, len(text), chunk_size - overlap):
-            chunk = text[i : i + chunk_size]
-            if len(chunk) > 100: # 过滤太短的噪音
-                chunks.append(chunk)
-        return chunks
-
-    def add_papers(self, papers_metadata):
-        self.logger.info(f"Processing papers (Chunk Size: {settings.RAG_CHUNK_SIZE}, Batch: {settings.EMBEDDING_BATCH_SIZE})")
-        new_count = 0
-        
-        for paper in tqdm(papers_metadata, desc="Building VectorDB"):
-            paper_id = paper['id']
-            title = paper['title']
-            
-            # 增量检查
-            existing = self.collection.get(where={"paper_id": paper_id}, limit=1)
-            if existing['ids']:
-                continue
-
-            # 下载逻辑不变...
-            pdf_path = self._download_pdf(paper.get('pdf_url'), paper_id, title)
-            if not pdf_path:
-                continue 
-            
-            full_text = self._parse_pdf(pdf_path)
-            chunks = self._chunk_text(full_text)
-            if not chunks:
-                continue
-
-            ids = [f"{paper_id}_chk_{i}" for i in range(len(chunks))]
-            
-            # [修改点 1]：在 metadata 中存入 url 和 pdf_url
-            metadatas = [{
-                "paper_id": paper_id,
-                "title": title,
-                "url": paper.get('url', ''),          # <--- 新增：DOI或落地页链接
-                "pdf_url": paper.get('pdf_url', ''),  # <--- 新增：PDF下载链接
-                "year": paper['year'] or 0,
-                "chunk_index": i
-            } for i in range(len(chunks))]
-            
-            self.collection.add(
-                documents=chunks,
-                metadatas=metadatas,
-                ids=ids
-            )
-            new_count += len(chunks)
-
-        if new_count > 0:
-            self.logger.info(f"Success: Added {new_count} new chunks to local DB.")
-        else:
-            self.logger.info("Skipped: All papers already exist in DB or download failed.")
-
-    def search(self, query: str, top_k: int = 5):
-        if self.collection.count() == 0:
-            return []
-        
-        # 检索时也会自动调用 Embedding API 将 query 向量化
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=top_k
-        )
-        docs = results['documents'][0]
-        metas = results['metadatas'][0]
-        structured_results = []
-        for i in range(len(docs)):
-            item = metas[i]           # 获取 metadata (含 title, url, year)
-            item['content'] = docs[i] # 将正文内容塞进去
-            structured_results.append(item)
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+import requests
+import fitz
+import chromadb
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from tqdm import tqdm
+from src.utils.logger import setup_logger
+from src.config import settings  # <--- 引入配置
+import openai
+import warnings
+from urllib3.exceptions import InsecureRequestWarning
+
+warnings.simplefilter('ignore', InsecureRequestWarning)
+
+# 单次 collection.add 写入的最大切片数 (跨论文累积后统一刷入，减少 Chroma 事务次数)
+ADD_FLUSH_SIZE = 2048
+# PDF 并发下载：总并发上限 + 单个站点的礼貌并发上限
+DOWNLOAD_WORKERS = 32
+PER_DOMAIN_DOWNLOADS = 4
+# PDF 解析时视为页眉/页脚的上下边距比例
+PAGE_MARGIN_RATIO = 0.08
+# 文件名中需要删除的非法字符 (str.translate 在 C 层完成，无需正则)
+_FILENAME_TRANS = str.maketrans("", "", '\\/*?:"<>|')
+
+# --- 1. 修改 Embedding 函数，支持配置化的 Batch Size ---
+class SiliconFlowEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, api_key: str, base_url: str, model_name: str, batch_size: int = 32,
+                 cache_path: str = None, concurrency: int = 4):
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url)
+        self.model_name = model_name
+        self.batch_size = batch_size  # <--- 从配置接收 batch_size
+        self.concurrency = max(1, concurrency)  # <--- 同时在途的 Embedding 请求数
+        # 线程池常驻复用，避免每次调用 (包括每次检索的 query 向量化) 都重新创建线程
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        # 本地 Embedding 缓存 (内容哈希 -> 向量)，重复入库时直接命中，不调用付费 API
+        self.cache = None
+        # 缓存连接跨线程共享 (批次线程池 + 多个会话的检索)，所有读写都在这把锁下串行
+        self._cache_lock = threading.Lock()
+        if cache_path:
+            self.cache = sqlite3.connect(cache_path, check_same_thread=False)
+            self.cache.execute("PRAGMA journal_mode=WAL")
+            self.cache.execute("PRAGMA synchronous=NORMAL")
+            self.cache.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self.cache.commit()
+
+    def _cache_key(self, text):
+        # 模型名参与哈希，切换 Embedding 模型后不会误用旧向量
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def _cache_lookup(self, keys):
+        """返回 {key: embedding}，只包含缓存命中的部分"""
+        if self.cache is None:
+            return {}
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # SQLite 单条语句的参数个数有限，按 500 分段查询
+        for i in range(0, len(unique_keys), 500):
+            part = unique_keys[i : i + 500]
+            placeholders = ",".join("?" * len(part))
+            with self._cache_lock:
+                rows = self.cache.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+            for key, blob in rows:
+                vec = array("d")
+                vec.frombytes(blob)
+                found[key] = vec.tolist()
+        return found
+
+    def _cache_store(self, keys, embeddings):
+        if self.cache is None or not keys:
+            return
+        rows = [(k, array("d", e).tobytes()) for k, e in zip(keys, embeddings)]
+        # 批次线程并发写入：共用一个连接的隐式事务，必须串行提交，否则会互相提交/回滚
+        with self._cache_lock, self.cache:
+            self.cache.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+            )
+
+    def _embed_batch(self, start, batch, keys):
+        try:
+            response = self.client.embeddings.create(
+                input=batch,
+                model=self.model_name
+            )
+            embeddings = [data.embedding for data in response.data]
+        except Exception as e:
+            print(f"❌ Embedding API Error at batch {start}: {e}")
+            raise e
+        # 每个批次成功后立即写缓存：其他批次失败时，已付费的向量不会随之丢失
+        self._cache_store(keys, embeddings)
+        return embeddings
+
+    def _embed(self, input, keys):
+        """直接调用 Embedding API (按 batch_size 分批，批次之间并发请求)"""
+        # 使用配置中的 self.batch_size
+        starts = list(range(0, len(input), self.batch_size))
+        batches = [input[i : i + self.batch_size] for i in starts]
+        key_batches = [keys[i : i + self.batch_size] for i in starts]
+
+        # 只有一个 batch (例如检索时的单条 query) 时直接在当前线程请求
+        if len(batches) == 1:
+            return self._embed_batch(starts[0], batches[0], key_batches[0])
+
+        # 网络往返是瓶颈，多个 batch 并发发送。先等所有批次结束再取结果：
+        # 某个批次失败时其余批次也已写入缓存，调用方逐篇重试不会为它们重复付费
+        futures = [self._pool.submit(self._embed_batch, *args) for args in zip(starts, batches, key_batches)]
+        wait(futures)
+        all_embeddings = []
+        for future in futures:
+            all_embeddings.extend(future.result())
+        return all_embeddings
+
+    def __call__(self, input: Documents) -> Embeddings:
+        input = [text.replace("\n", " ") for text in input]
+
+        # 先查缓存，只把未命中的文本发给 API
+        keys = [self._cache_key(text) for text in input]
+        cached = self._cache_lookup(keys)
+
+        miss = {}  # key -> text (去重，同一文本只请求一次)
+        for key, text in zip(keys, input):
+            if key not in cached and key not in miss:
+                miss[key] = text
+
+        if miss:
+            miss_keys = list(miss)
+            new_embeddings = self._embed([miss[k] for k in miss_keys], miss_keys)
+            cached.update(zip(miss_keys, new_embeddings))
+
+        return [cached[key] for key in keys]
+
+# --- 2. 修改主类，应用 Chunk 参数 ---
+class LocalVectorStore:
+    def __init__(self, persist_dir="data/vector_store"):
+        self.logger = setup_logger("VectorStore")
+        self.pdf_dir = "data/cache/pdfs"
+        self.embedding_cache_path = "data/cache/embeddings.db"
+        
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        os.makedirs(persist_dir, exist_ok=True)
+
+        # 下载复用同一个 Session：请求头只设置一次，同一站点的 TCP/TLS 连接在多篇论文间复用
+        self.http = requests.Session()
+        # 稍微增强一点 Headers，模拟真实浏览器
+        self.http.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept': 'application/pdf,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Connection': 'keep-alive',
+            'Referer': 'https://scholar.google.com/' 
+        })
+
+        # 按域名限流：真正需要约束的是对同一站点的并发，而不是全局并发
+        self._domain_sems = defaultdict(lambda: threading.Semaphore(PER_DOMAIN_DOWNLOADS))
+        self._domain_lock = threading.Lock()
+        self._download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+
+        self.client = chromadb.PersistentClient(path=persist_dir)
+        
+        self.logger.info(f"Init Embedding: {settings.EMBEDDING_MODEL_NAME} | Batch: {settings.EMBEDDING_BATCH_SIZE}")
+        
+        # [修改] 传入配置的 batch_size
+        self.ef = SiliconFlowEmbeddingFunction(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            model_name=settings.EMBEDDING_MODEL_NAME,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            cache_path=self.embedding_cache_path,
+            concurrency=settings.EMBEDDING_CONCURRENCY
+        )
+        
+        self.collection = self.client.get_or_create_collection(
+            name="research_papers",
+            embedding_function=self.ef
+        )
+
+    def _sanitize_filename(self, title):
+        clean_name = title.translate(_FILENAME_TRANS)
+        clean_name = " ".join(clean_name.split())
+        return clean_name[:50]
+
+    def _hash_file(self, path):
+        """流式计算本地文件的 SHA-256"""
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _domain_semaphore(self, url):
+        domain = urlparse(url).netloc
+        with self._domain_lock:
+            return self._domain_sems[domain]
+
+    def _download_paper(self, paper):
+        """线程池任务：在所属域名的并发额度内下载单篇论文"""
+        url = paper.get('pdf_url')
+        if not url:
+            return None, None
+        with self._domain_semaphore(url):
+            return self._download_pdf(url, paper['id'], paper['title'])
+
+    def _download_pdf(self, url, paper_id, title):
+        """下载 PDF (带详细 Debug)，返回 (本地路径, 内容 SHA-256)"""
+        if not url:
+            return None, None
+        
+        # 文件名 = ID + 标题哈希：定长、纯 ASCII，不需要逐字符清洗标题
+        short_id = paper_id.split("/")[-1]
+        title_hash = hashlib.blake2b(title.encode("utf-8"), digest_size=6).hexdigest()
+        save_path = os.path.join(self.pdf_dir, f"{short_id}_{title_hash}.pdf")
+        
+        if os.path.exists(save_path):
+            return save_path, self._hash_file(save_path)
+
+        # 兼容旧缓存：之前按 "ID_清洗后标题.pdf" 命名的文件直接复用
+        legacy_path = os.path.join(self.pdf_dir, f"{short_id}_{self._sanitize_filename(title)}.pdf")
+        if os.path.exists(legacy_path):
+            return legacy_path, self._hash_file(legacy_path)
+
+        try:
+            # verify=False 解决证书问题，stream=True 优化大文件下载
+            response = self.http.get(url, timeout=20, verify=False, stream=True)
+            
+            # [新增] 检查状态码，如果不是 200，主动抛出异常以便被 except 捕获并打印
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+
+            # 边写边算哈希，用于识别不同 paper_id 指向同一份 PDF 的情况
+            h = hashlib.sha256()
+            with open(save_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    h.update(chunk)
+                    f.write(chunk)
+            return save_path, h.hexdigest()
+
+        except Exception as e:
+            # [新增] 打印具体的 URL 和错误原因，方便你排查
+            # 热路径日志使用 % 惰性格式化，日志级别关闭时不会拼接字符串
+            self.logger.warning("⚠️ Download Failed: %s | URL: %s", e, url)
+            # 如果是 IEEE 这种反爬严重的，这里会打印 HTTP 418 或 403
+            return None, None
+
+    def _parse_pdf(self, pdf_path):
+        if not pdf_path: return ""
+        try:
+            # 直接按路径打开：MuPDF 按需从文件读取页面，不需要先把整个 PDF 读进 Python 内存；
+            # with 语句保证解析完立即释放文档句柄
+            pages = []
+            with fitz.open(pdf_path) as doc:
+                for page in doc:
+                    # 按文本块提取，丢弃完全落在页眉/页脚区域内的块 (页码、期刊名、版权声明等)；
+                    # 跨入边距区域的正文段落仍然保留
+                    top = page.rect.height * PAGE_MARGIN_RATIO
+                    bottom = page.rect.height * (1 - PAGE_MARGIN_RATIO)
+                    blocks = page.get_text("blocks")
+                    pages.append("\n".join(
+                        b[4] for b in blocks
+                        if b[6] == 0 and b[3] > top and b[1] < bottom  # b[6] == 0: 文本块 (1 为图片)
+                    ))
+            return "\n".join(pages)
+        except Exception as e:
+            self.logger.error(f"PDF parse error: {e}")
+            return ""
+
+    # [关键修改] 让 _chunk_text 读取配置参数
+    def _chunk_text(self, text):
+        """使用 .env 配置进行切片"""
+        chunk_size = settings.RAG_CHUNK_SIZE
+        overlap = settings.RAG_CHUNK_OVERLAP
+        
+        if not text: return []
+        chunks = []
+        # 滑动窗口切片逻辑
+        for i in range(0, len(text), chunk_size - overlap):
+            chunk = text[i : i + chunk_size]
+            if len(chunk) > 100: # 过滤太短的噪音
+                chunks.append(chunk)
+        return chunks
+
+    def _embed_entries(self, entries):
+        """为每篇论文的切片计算向量，返回 [(docs, metas, ids, embeddings)]；向量化失败的论文被跳过"""
+        if not entries:
+            return []
+        try:
+            all_embs = self.ef([d for docs, _, _ in entries for d in docs])
+        except Exception as e:
+            # 整体请求中某个批次失败 (如 429)：已成功的批次已写入缓存，逐篇重试时直接命中，
+            # 只有仍然失败的论文被跳过，其余论文照常入库
+            self.logger.warning("Embedding failed (%s), retrying paper by paper", e)
+            result = []
+            for docs, metas, ids in entries:
+                try:
+                    result.append((docs, metas, ids, self.ef(docs)))
+                except Exception as e:
+                    self.logger.error("Embedding failed for %s, skipped: %s", metas[0]["paper_id"], e)
+            return result
+
+        result, pos = [], 0
+        for docs, metas, ids in entries:
+            result.append((docs, metas, ids, all_embs[pos : pos + len(docs)]))
+            pos += len(docs)
+        return result
+
+    def _group_flushes(self, entries):
+        """把论文按顺序装进不超过 ADD_FLUSH_SIZE 个切片的批次 (单篇超过上限时独占一批)"""
+        flush, size = [], 0
+        for entry in entries:
+            if flush and size + len(entry[0]) > ADD_FLUSH_SIZE:
+                yield flush
+                flush, size = [], 0
+            flush.append(entry)
+            size += len(entry[0])
+        if flush:
+            yield flush
+
+    def add_papers(self, papers_metadata):
+        self.logger.info(f"Processing papers (Chunk Size: {settings.RAG_CHUNK_SIZE}, Batch: {settings.EMBEDDING_BATCH_SIZE})")
+        # 先跨论文累积所有切片 (每篇一组 (docs, metas, ids))，循环结束后再批量写入 ChromaDB
+        entries = []
+        # 本轮已处理过的 PDF 内容哈希 (跨会话去重依赖 metadata 中的 sha256 字段)
+        seen_hashes = set()
+        
+        # 增量检查
+        pending = [
+            paper for paper in papers_metadata
+            if not self.collection.get(where={"paper_id": paper['id']}, limit=1)['ids']
+        ]
+
+        # 并发下载：不同站点并行，同一站点最多 PER_DOMAIN_DOWNLOADS 个连接
+        downloads = list(tqdm(self._download_pool.map(self._download_paper, pending), total=len(pending), desc="Downloading PDFs"))
+
+        for paper, (pdf_path, pdf_hash) in tqdm(zip(pending, downloads), total=len(pending), desc="Building VectorDB"):
+            paper_id = paper['id']
+            title = paper['title']
+
+            if not pdf_path:
+                continue 
+
+            # 内容去重：同一份 PDF 已入库则跳过解析与 Embedding
+            if pdf_hash in seen_hashes:
+                continue
+            seen_hashes.add(pdf_hash)
+            if self.collection.get(where={"sha256": pdf_hash}, limit=1)['ids']:
+                self.logger.info("Duplicate PDF content, skipped: %s", title)
+                continue
+            
+            full_text = self._parse_pdf(pdf_path)
+            chunks = self._chunk_text(full_text)
+            if not chunks:
+                continue
+
+            ids = [f"{paper_id}_chk_{i}" for i in range(len(chunks))]
+            
+            # [修改点 1]：在 metadata 中存入 url 和 pdf_url
+            # 同一篇论文的切片只有 chunk_index 不同，公共字段只构造一次
+            template = {
+                "paper_id": paper_id,
+                "title": title,
+                "url": paper.get('url') or '',          # <--- 新增：DOI或落地页链接
+                "pdf_url": paper.get('pdf_url') or '',  # <--- 新增：PDF下载链接
+                "year": paper['year'] or 0,
+                "sha256": pdf_hash
+            }
+            metadatas = [{**template, "chunk_index": i} for i in range(len(chunks))]
+            
+            entries.append((chunks, metadatas, ids))
+
+        # 在 Chroma 之外算好全部向量 (批次并发)，写库时不需要同步调用 Embedding API
+        entries = self._embed_entries(entries)
+
+        # 分批刷入：事务次数从 O(论文数) 降为 O(总切片数 / ADD_FLUSH_SIZE)
+        # 使用幂等的 upsert，某一批失败只记录日志；每批只包含完整的论文 (不跨论文边界切分)，
+        # 失败批次中的论文在库里完全不存在，下次运行的增量检查会重新处理它们
+        new_count = 0
+        for flush in self._group_flushes(entries):
+            docs, metas, ids, embs = ([x for entry in flush for x in entry[k]] for k in range(4))
+            try:
+                self.collection.upsert(documents=docs, embeddings=embs, metadatas=metas, ids=ids)
+                new_count += len(ids)
+            except Exception as e:
+                self.logger.error("Upsert failed for %d papers (%d chunks): %s", len(flush), len(ids), e)
+
+        if new_count > 0:
+            self.logger.info(f"Success: Added {new_count} new chunks to local DB.")
+        else:
+            self.logger.info("Skipped: All papers already exist in DB or download failed.")
+
+    def search(self, query: str, top_k: int = 5):
+        if self.collection.count() == 0:
+            return []
+        
+        # 检索时也会自动调用 Embedding API 将 query 向量化
+        results = self.collection.query(
+            query_texts=[query],
+            n_results=top_k
+        )
+        docs = results['documents'][0]
+        metas = results['metadatas'][0]
+        structured_results = []
+        for i in range(len(docs)):
+            item = metas[i]           # 获取 metadata (含 title, url, year)
+            item['content'] = docs[i] # 将正文内容塞进去
+            structured_results.append(item)
         return structured_results # 返回 List[Dict]
\ No newline at end of file
@@ -4,19 +4,21 @@ from colorama import Fore, Style, init
 
 init(autoreset=True)
 
+# 日志格式只需拼接一次，所有模块共享同一个 Formatter
+LOG_FORMAT = (
+    f'{Fore.GREEN}%(asctime)s{Style.RESET_ALL} | '
+    f'{Fore.CYAN}%(levelname)s{Style.RESET_ALL} | '
+    f'%(message)s'
+)
+_FORMATTER = logging.Formatter(LOG_FORMAT, datefmt='%H:%M:%S')
+
 def setup_logger(name="ScholarRAG"):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
     
     if not logger.handlers:
         handler = logging.StreamHandler(sys.stdout)
-        formatter = logging.Formatter(
-            f'{Fore.GREEN}%(asctime)s{Style.RESET_ALL} | '
-            f'{Fore.CYAN}%(levelname)s{Style.RESET_ALL} | '
-            f'%(message)s',
-            datefmt='%H:%M:%S'
-        )
-        handler.setFormatter(formatter)
+        handler.setFormatter(_FORMATTER)
         logger.addHandler(handler)
     
     return logger
\ No newline at end of file
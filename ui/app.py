@@ -1,53 +1,170 @@
 # ui/app.py
 import streamlit as st
-import time
-import json
+import os
+import sys
+import html
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from db import (
     init_db, register_user, login_user, share_chat_to_square, 
-    get_inspiration_posts, like_post, get_academic_star, 
-    save_private_chat, get_private_history_list, save_or_update_chat,
-    delete_shared_chat  # <--- 新增这个
+    get_square_bundle, like_post, get_user_likes_in, FEED_PAGE_SIZE,
+    save_private_chat, get_private_history_list, get_private_chat_messages, save_or_update_chat,
+    delete_shared_chat,  # <--- 新增这个
+    unpack_content, get_post_content
 )
-from logic import process_query, get_engine, recursive_summarize
 
-# 初始化数据库
-init_db()
+# 确保能导入 src (与 logic.py 相同)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.logger import setup_logger
+
+logger = setup_logger("App")
 
-# 页面配置
+# 页面配置 (必须是第一条 Streamlit 命令，cache_resource 的加载提示也算在内)
 st.set_page_config(page_title="ScholarRAG", page_icon="🎓", layout="wide")
 
+# 初始化数据库
+# 建表/建索引/迁移每个进程只做一次 (cache_resource)，rerun 时不会重复执行
+@st.cache_resource
+def _init_db_once():
+    init_db()
+
+_init_db_once()
+
+# 读库结果缓存：Streamlit 每次交互都会整页重跑，避免每次重跑都查询 SQLite。
+# 写操作之后调用对应的 invalidate 函数，保证用户能立即看到自己的修改；
+# 历史列表按 (用户名, 版本号) 缓存，写操作只递增该用户的版本号，其他用户的缓存不受影响
+@st.cache_resource
+def _history_versions():
+    return defaultdict(int)
+
+@st.cache_data(ttl=30, max_entries=128, show_spinner=False)
+def _cached_history(username, version):
+    return get_private_history_list(username)
+
+def cached_history_list(username):
+    return _cached_history(username, _history_versions()[username])
+
+# 广场按已加载的条数缓存：整段范围来自同一次查询，页与页之间排名一致
+@st.cache_data(ttl=30, max_entries=128, show_spinner=False)
+def cached_square_bundle(limit=FEED_PAGE_SIZE):
+    return get_square_bundle(limit)
+
+# 帖子详情按 ID 读取并拼成一段 Markdown (发布后内容不变，按 ID 缓存)；
+# 内容来自其他用户，用 st.markdown 渲染 (原始 HTML 会被转义)，不能走 st.html
+@st.cache_data(max_entries=256, show_spinner=False)
+def _post_detail_markdown(pid):
+    return "\n\n".join(
+        f"**{'🧑‍💻' if msg['role'] == 'user' else '🤖'} {msg['role']}**: {msg['content']}"
+        for msg in unpack_content(get_post_content(pid))
+    )
+
+def invalidate_history(username):
+    _history_versions()[username] += 1
+
+def invalidate_square():
+    cached_square_bundle.clear()
+
+# 跨一次 rerun 的提示：先记下来立即跳转，下一次渲染时再弹出
+def flash(msg, icon=None, balloons=False):
+    st.session_state.flash_toast = (msg, icon, balloons)
+
+def show_flash():
+    pending = st.session_state.pop("flash_toast", None)
+    if pending:
+        msg, icon, balloons = pending
+        if balloons:
+            st.balloons()
+        st.toast(msg, icon=icon)
+
+# 后台写库线程 (进程级单例)。单线程按提交顺序执行，同一对话的多次更新不会乱序
+@st.cache_resource
+def get_db_writer():
+    return ThreadPoolExecutor(max_workers=1)
+
+def _on_chat_saved(username, future):
+    if future.exception():
+        logger.error("Auto-save failed: %s", future.exception())
+    invalidate_history(username)
+
+def apply_pending_save():
+    """确认上一次后台保存的结果：成功才推进 saved_msg_count；失败则提示，未入库的消息在下一轮一起重新提交"""
+    pending = st.session_state.get("pending_save")
+    if pending is None or not pending[2].done():
+        return
+    del st.session_state.pending_save
+    chat_id, upto, future = pending
+    if chat_id != st.session_state.current_chat_id:
+        return
+    if future.exception() is None:
+        st.session_state.saved_msg_count = max(st.session_state.saved_msg_count, upto)
+    else:
+        st.toast("自动保存失败，未保存的消息会在下一轮对话时重试", icon="⚠️")
+
+# 后台摘要线程池 (进程级单例)：摘要是一次完整的 LLM 调用，不能卡在本轮渲染上
+@st.cache_resource
+def get_summary_pool():
+    return ThreadPoolExecutor(max_workers=2)
+
+def apply_pending_summary():
+    """把上一轮提交的后台摘要合并进会话状态；期间切换过对话则丢弃。
+    摘要还没算完时不等待，保持挂起，本轮照常用未总结的消息构造上下文"""
+    pending = st.session_state.get("pending_summary")
+    if pending is None or not pending[2].done():
+        return
+    del st.session_state.pending_summary
+    chat_id, upto, future = pending
+    if chat_id != st.session_state.current_chat_id:
+        return
+    if not (st.session_state.last_summarized_idx < upto <= len(st.session_state.messages)):
+        return
+    st.session_state.current_summary = future.result()
+    # 摘要只覆盖到提交时的 upto 条，之后新增的消息仍算未总结
+    st.session_state.recent_context_buf = st.session_state.recent_context_buf[upto - st.session_state.last_summarized_idx:]
+    st.session_state.last_summarized_idx = upto
+    st.session_state.unsummarized_chars = sum(len(m['content']) for m in st.session_state.messages[upto:])
+
+# 递归摘要触发阈值：未总结文本超过该字符数，或未总结消息达到该条数 (3 轮问答)
+SUMMARY_CHAR_BUDGET = 2000
+SUMMARY_MAX_MSGS = 6
+# 对话页默认渲染的最近消息条数
+RECENT_MSG_COUNT = 20
+
 # 加载 CSS
-with open("ui/style.css") as f:
-    st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+# 拼好的 <style> 标签缓存到磁盘，用 st.html 注入；mtime 参与缓存键，改了样式会自动失效
+@st.cache_data(persist="disk", show_spinner=False)
+def _load_css(path, mtime):
+    with open(path, encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
+CSS_PATH = "ui/style.css"
+st.html(_load_css(CSS_PATH, os.path.getmtime(CSS_PATH)))
 
 # --- 状态管理 ---
-if "logged_in" not in st.session_state:
-    st.session_state.logged_in = False
-if "username" not in st.session_state:
-    st.session_state.username = ""
-if "page" not in st.session_state:
-    st.session_state.page = "chat" # chat, square, profile
-if "messages" not in st.session_state:
-    st.session_state.messages = [] # 当前对话历史
-if "chat_history_list" not in st.session_state:
-    st.session_state.chat_history_list = [] # 历史会话列表 (模拟)
+# 所有会话状态默认值集中在一处，只在会话首次运行时写入
+_SESSION_DEFAULTS = {
+    "logged_in": False,
+    "username": "",
+    "page": "chat",  # chat, square, profile
+    "messages": [],  # 当前对话历史
+    "chat_history_list": [],  # 历史会话列表 (模拟)
+    # 递归摘要状态
+    "current_summary": "",  # 当前的全局摘要
+    "last_summarized_idx": 0,  # 指针：messages中多少条已被总结
+    "unsummarized_chars": 0,  # 尚未被总结的消息累计字符数
+    "recent_context_buf": [],  # 未总结消息的 "role: content" 行，逐条追加，避免每轮重新格式化整个窗口
+    "saved_msg_count": 0,  # 指针：messages中多少条已写入数据库
+    "current_chat_id": None,  # None 表示这是个新对话，还没入库
+    "feed_pages": 1,  # 灵感广场已加载的页数
+}
 
 def init_session():
-    if "logged_in" not in st.session_state:
-        st.session_state.logged_in = False
-    if "username" not in st.session_state:
-        st.session_state.username = ""
-    if "messages" not in st.session_state:
-        st.session_state.messages = [] 
-    
-    # [新增] 递归摘要状态
-    if "current_summary" not in st.session_state:
-        st.session_state.current_summary = "" # 当前的全局摘要
-    if "last_summarized_idx" not in st.session_state:
-        st.session_state.last_summarized_idx = 0 # 指针：messages中多少条已被总结
-
-    if "current_chat_id" not in st.session_state:
-        st.session_state.current_chat_id = None # None 表示这是个新对话，还没入库
+    if st.session_state.get("_init_done"):
+        return
+    for key, value in _SESSION_DEFAULTS.items():
+        # 可变默认值要拷贝，避免不同会话共享同一个列表
+        st.session_state.setdefault(key, value.copy() if isinstance(value, list) else value)
+    st.session_state._init_done = True
 
 init_session()
 
@@ -77,117 +194,177 @@ def login_page():
                 st.error("用户已存在")
 
 # --- 侧边栏 ---
+MODE_OPTIONS = ["review (综述)", "explain (深度)", "inspire (脑暴)"]
+
 def sidebar():
     with st.sidebar:
-        st.markdown('<div class="rainbow-text">ScholarRAG</div>', unsafe_allow_html=True)
-        st.caption(f"🚀 Current User: **{st.session_state.username}**")
-        st.divider()
-        
-        # [修改] 发起新对话 -> 存入数据库
-        if st.button("➕ 发起新对话", use_container_width=True):
+        sidebar_fragment()
+
+def get_chat_options():
+    """从会话状态读取功能区选项，返回 (mode_key, use_graph)"""
+    mode = st.session_state.get("mode_choice", MODE_OPTIONS[0])
+    return mode.split(" ")[0], st.session_state.get("use_graph", True) # 提取 'review' 等
+
+# 侧边栏是一个 fragment：切换模式/勾选图谱只重跑侧边栏。
+# 选项通过 widget key 写入 session_state，由对话区自行读取 (fragment 的返回值不会传出)
+@st.fragment
+def sidebar_fragment():
+    st.markdown('<div class="rainbow-text">ScholarRAG</div>', unsafe_allow_html=True)
+    st.caption(f"🚀 Current User: **{st.session_state.username}**")
+    st.divider()
+    
+    # [修改] 发起新对话 -> 存入数据库
+    if st.button("➕ 发起新对话", use_container_width=True):
+        # 已经是空白新对话时不需要整页重跑
+        if st.session_state.messages or st.session_state.current_chat_id is not None or st.session_state.page != "chat":
             # 不需要再手动 save 了，因为每句话都自动 save 过
             # 清空状态，准备迎接新对话
             st.session_state.messages = []
             st.session_state.current_summary = ""
             st.session_state.last_summarized_idx = 0
+            st.session_state.unsummarized_chars = 0
+            st.session_state.recent_context_buf = []
+            st.session_state.saved_msg_count = 0
             st.session_state.current_chat_id = None # 重置 ID，下次说话会创建新记录
             st.session_state.page = "chat"
             st.rerun()
+    
+    st.divider()
+    st.subheader("🕒 历史归档 (DB)")
+    
+    # [修改] 从数据库读取历史 (带缓存，新增/删除对话时失效)
+    history_list = cached_history_list(st.session_state.username)
+    
+    if not history_list:
+        st.caption("暂无历史记录")
+
+    for item in history_list:
+        # [修改] 调整列比例，让删除按钮贴在最右边
+        # 使用 container 将其包裹，虽然 Streamlit 的 columns 本身就是 block，
+        # 但为了确保 CSS 能够精准捕获 hover，我们保持结构简单
+        col1, col2 = st.columns([5, 1])
         
-        st.divider()
-        st.subheader("🕒 历史归档 (DB)")
-        
-        # [修改] 从数据库读取历史
-        # 注意：每次刷新页面这里都会读库，量大时可以加 cache
-        history_list = get_private_history_list(st.session_state.username)
-        
-        if not history_list:
-            st.caption("暂无历史记录")
-
-        for item in history_list:
-            # [修改] 调整列比例，让删除按钮贴在最右边
-            # 使用 container 将其包裹，虽然 Streamlit 的 columns 本身就是 block，
-            # 但为了确保 CSS 能够精准捕获 hover，我们保持结构简单
-            col1, col2 = st.columns([5, 1])
+        with col1:
+            # 截断标题，防止换行破坏布局
+            display_title = (item['summary'][:16] + '..') if len(item['summary']) > 16 else item['summary']
             
-            with col1:
-                # 截断标题，防止换行破坏布局
-                display_title = (item['summary'][:16] + '..') if len(item['summary']) > 16 else item['summary']
-                
-                # [关键] 加载按钮：使用 use_container_width=True 让它填满左侧空间
-                # 这样用户的鼠标只要在左侧区域，都能触发 Hover
-                if st.button(f"📄 {display_title}", key=f"hist_load_{item['id']}", use_container_width=True):
-                    st.session_state.messages = item['msgs']
+            # [关键] 加载按钮：使用 use_container_width=True 让它填满左侧空间
+            # 这样用户的鼠标只要在左侧区域，都能触发 Hover
+            if st.button(f"📄 {display_title}", key=f"hist_load_{item['id']}", use_container_width=True):
+                # 点击的正是当前打开的对话时不重复加载、不重跑
+                if st.session_state.current_chat_id != item['id'] or st.session_state.page != "chat":
+                    # 历史列表只有元信息，点开时才按 ID 读取消息
+                    msgs = get_private_chat_messages(item['id'])
+                    st.session_state.messages = msgs
+                    # 恢复摘要状态 (为了简单，恢复历史时，默认摘要就是数据库存的那个，指针指向末尾)
                     st.session_state.current_summary = item['summary']
-                    st.session_state.last_summarized_idx = len(item['msgs'])
+                    st.session_state.last_summarized_idx = len(msgs)
+                    st.session_state.unsummarized_chars = 0
+                    st.session_state.recent_context_buf = []
+                    st.session_state.saved_msg_count = len(msgs)
+                    # [关键] 加载历史时，必须把 ID 也加载进来，这样继续聊就是在旧记录上追加
                     st.session_state.current_chat_id = item['id']
                     st.session_state.page = "chat"
                     st.rerun()
-            
-            with col2:
-                # [关键] 删除按钮：只放一个图标
-                # CSS 会负责默认隐藏它，只有 Hover 时显示
-                if st.button("🗑️", key=f"hist_del_{item['id']}", use_container_width=True):
-                    from db import delete_private_chat
-                    delete_private_chat(item['id'])
-                    
-                    if st.session_state.get("current_chat_id") == item['id']:
-                        st.session_state.messages = []
-                        st.session_state.current_summary = ""
-                        st.session_state.current_chat_id = None
-                        st.toast("对话已删除")
-                    
-                    st.rerun()
-            # 截断一下 summary 防止太长
-            display_title = (item['summary'][:200] + '..') if len(item['summary']) > 200 else item['summary']
-            if st.button(f"📄 {display_title}", key=f"hist_{item['id']}"):
-                st.session_state.messages = item['msgs']
-                # 恢复摘要状态 (为了简单，恢复历史时，默认摘要就是数据库存的那个，指针指向末尾)
-                st.session_state.current_summary = item['summary']
-                st.session_state.last_summarized_idx = len(item['msgs'])
-                # [关键] 加载历史时，必须把 ID 也加载进来，这样继续聊就是在旧记录上追加
-                st.session_state.current_chat_id = item['id']
-                st.session_state.page = "chat"
+        
+        with col2:
+            # [关键] 删除按钮：只放一个图标
+            # CSS 会负责默认隐藏它，只有 Hover 时显示
+            if st.button("🗑️", key=f"hist_del_{item['id']}", use_container_width=True):
+                from db import delete_private_chat
+                delete_private_chat(item['id'])
+                invalidate_history(st.session_state.username)
+                
+                if st.session_state.get("current_chat_id") == item['id']:
+                    st.session_state.messages = []
+                    st.session_state.current_summary = ""
+                    st.session_state.last_summarized_idx = 0
+                    st.session_state.unsummarized_chars = 0
+                    st.session_state.recent_context_buf = []
+                    st.session_state.saved_msg_count = 0
+                    st.session_state.current_chat_id = None
+                    st.toast("对话已删除")
+                
                 st.rerun()
 
-        st.divider()
-        st.subheader("🛠️ 功能区")
-        mode = st.radio("选择模式", ["review (综述)", "explain (深度)", "inspire (脑暴)"], index=0)
-        mode_key = mode.split(" ")[0] # 提取 'review' 等
+    st.divider()
+    st.subheader("🛠️ 功能区")
+    st.radio("选择模式", MODE_OPTIONS, index=0, key="mode_choice")
+    st.checkbox("启用知识图谱增强", value=True, key="use_graph")
+
+    st.divider()
+    if st.button("✨ 灵感广场", use_container_width=True) and st.session_state.page != "square":
+        st.session_state.page = "square"
+        st.rerun()
+        
+    if st.button("⚙️ 设置 / 个人信息", use_container_width=True) and st.session_state.page != "profile":
+        st.session_state.page = "profile"
+        st.rerun()
         
-        use_graph = st.checkbox("启用知识图谱增强", value=True)
+    if st.button("退出登录"):
+        st.session_state.logged_in = False
+        st.rerun()
+
 
+# 参考来源拼成一段 Markdown 列表，一次 st.markdown 渲染
+def sources_markdown(sources):
+    return "\n".join(f"- [{p['year']}] **{p['title']}** [PDF]({p['pdf_url']})" for p in sources)
+
+def render_message(msg):
+    with st.chat_message(msg["role"]):
+        # 用 st.markdown 渲染：保留 KaTeX 公式、代码高亮，并转义原始 HTML (如 List<String>)
+        st.markdown(msg["content"])
+        if "sources" in msg and msg["sources"]:
+            with st.expander("📚 参考来源"):
+                st.markdown(sources_markdown(msg["sources"]))
+
+# 更早的消息每条一个 st.markdown (连同参考来源)，不创建 chat_message / expander
+def render_older_messages(messages):
+    for msg in messages:
+        role_icon = "🧑‍💻" if msg["role"] == "user" else "🤖"
+        text = f"**{role_icon} {msg['role']}**\n\n{msg['content']}"
+        if msg.get("sources"):
+            text += "\n\n📚 **参考来源**\n\n" + sources_markdown(msg["sources"])
+        st.markdown(text)
         st.divider()
-        if st.button("✨ 灵感广场", use_container_width=True):
-            st.session_state.page = "square"
-            st.rerun()
-            
-        if st.button("⚙️ 设置 / 个人信息", use_container_width=True):
-            st.session_state.page = "profile"
-            st.rerun()
-            
-        if st.button("退出登录"):
-            st.session_state.logged_in = False
-            st.rerun()
-            
-        return mode_key, use_graph
 
 # --- 聊天主逻辑 (集成递归摘要) ---
-def chat_page(mode, use_graph):
+def chat_page():
     st.header("💬 学术对话")
-    
+    # 输入框必须放在顶层才会固定在页面底部 (放进 fragment 会变成内联组件)，
+    # 提交的问题经 session_state 交给对话区处理
+    if prompt := st.chat_input("输入你的研究问题..."):
+        st.session_state.pending_prompt = prompt
+    chat_fragment()
+
+# 对话区是一个 fragment：展开历史、分享等操作只重跑这一块，侧边栏和登录检查不随之重跑
+@st.fragment
+def chat_fragment():
+    # 模式选项从 session_state 读取，侧边栏单独重跑后这里也能拿到最新值
+    mode, use_graph = get_chat_options()
+    # 上一轮后台保存的结果 (成功推进指针，失败弹出提示)
+    apply_pending_save()
     # 1. 渲染历史
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
-            if "sources" in msg and msg["sources"]:
-                with st.expander("📚 参考来源"):
-                    for p in msg["sources"]:
-                        st.write(f"- [{p['year']}] **{p['title']}** [PDF]({p['pdf_url']})")
+    # 默认只渲染最近 RECENT_MSG_COUNT 条，更早的消息由用户手动展开
+    messages = st.session_state.messages
+    older, recent = messages[:-RECENT_MSG_COUNT], messages[-RECENT_MSG_COUNT:]
+    if older and st.toggle(f"📜 显示更早的 {len(older)} 条消息", key="show_older_msgs"):
+        render_older_messages(older)
+    for msg in recent:
+        render_message(msg)
 
     # 2. 处理输入
-    if prompt := st.chat_input("输入你的研究问题..."):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+    if prompt := st.session_state.pop("pending_prompt", None):
+        # 延迟导入：logic 会连带加载 chromadb / fitz / openai 等重依赖，登录页、广场等页面用不到
+        from logic import process_query, get_generator, recursive_summarize
+
+        # 先合并上一轮的后台摘要，再构造本轮上下文
+        apply_pending_summary()
+
+        user_msg = {"role": "user", "content": prompt}
+        st.session_state.messages.append(user_msg)
+        st.session_state.unsummarized_chars += len(prompt)
+        st.session_state.recent_context_buf.append(f"user: {prompt}")
         with st.chat_message("user"):
             st.markdown(prompt)
 
@@ -200,11 +377,8 @@ def chat_page(mode, use_graph):
             # 这样既不会丢失很久以前的信息，也保留了最近的鲜活上下文
             
             # 为了给 LLM 最好的 Prompt，我们这里把未总结的 raw text 也拼进去
-            unsummarized_msgs = st.session_state.messages[st.session_state.last_summarized_idx:]
-            # 这里的 unsummarized_msgs 其实包含了刚刚用户发的 prompt
-            # 我们只需要把 prompt 之前的拿出来做 context 即可，但为了简单，全部给 logic 处理
-            
-            recent_context_str = "\n".join([f"{m['role']}: {m['content']}" for m in unsummarized_msgs[:-1]]) # 不含当前prompt
+            # recent_context_buf 与未总结消息一一对应，每条消息只格式化一次
+            recent_context_str = "\n".join(st.session_state.recent_context_buf[:-1]) # 不含当前prompt
             
             full_context_str = f"""
             [Previous Summary]: {st.session_state.current_summary}
@@ -212,21 +386,25 @@ def chat_page(mode, use_graph):
             """
             
             # --- [B] 生成回答 ---
-            response, sources = process_query(prompt, mode, use_graph, full_context_str)
+            # 检索完成后流式输出回答，首个 token 到达即开始显示
+            stream, sources = process_query(prompt, mode, use_graph, full_context_str, stream=True)
             
             # 显示
-            placeholder.markdown(response)
+            placeholder.empty()
+            response = st.write_stream(stream)
             if sources:
                 with st.expander("📚 参考来源"):
-                    for p in sources:
-                         st.write(f"- [{p['year']}] **{p['title']}** [PDF]({p['pdf_url']})")
+                    st.markdown(sources_markdown(sources))
             
             # 存入历史
-            st.session_state.messages.append({
+            assistant_msg = {
                 "role": "assistant", 
                 "content": response,
                 "sources": sources
-            })
+            }
+            st.session_state.messages.append(assistant_msg)
+            st.session_state.unsummarized_chars += len(response)
+            st.session_state.recent_context_buf.append(f"assistant: {response}")
 
             # ---------------------------------------------------------
             # [新增] 自动保存逻辑 (Auto-Save)
@@ -237,33 +415,61 @@ def chat_page(mode, use_graph):
                 current_sum = st.session_state.messages[0]['content'][:30] + "..."
 
             # 2. 写入数据库 (Upsert)
-            new_id = save_or_update_chat(
-                chat_id=st.session_state.current_chat_id,
-                username=st.session_state.username,
-                summary=current_sum,
-                messages=st.session_state.messages
-            )
-            
-            # 3. 更新当前 ID (这样下一轮对话就会走 Update 逻辑而不是 Insert)
-            st.session_state.current_chat_id = new_id
+            is_new_chat = st.session_state.current_chat_id is None
+            if is_new_chat:
+                # 新对话需要拿到数据库生成的 ID，同步写入
+                new_id = save_or_update_chat(
+                    chat_id=None,
+                    username=st.session_state.username,
+                    summary=current_sum,
+                    new_messages=st.session_state.messages
+                )
+                
+                # 3. 更新当前 ID (这样下一轮对话就会走 Update 逻辑而不是 Insert)
+                st.session_state.current_chat_id = new_id
+                st.session_state.saved_msg_count = len(st.session_state.messages)
+                invalidate_history(st.session_state.username)
+            else:
+                # 已有对话的更新交给后台线程，不阻塞本轮渲染；只提交尚未入库的新消息
+                future = get_db_writer().submit(
+                    save_or_update_chat,
+                    st.session_state.current_chat_id,
+                    st.session_state.username,
+                    current_sum,
+                    st.session_state.messages[st.session_state.saved_msg_count:],
+                    st.session_state.saved_msg_count
+                )
+                future.add_done_callback(partial(_on_chat_saved, st.session_state.username))
+                # 写入成功后 (下一次重跑时由 apply_pending_save 确认) 才推进 saved_msg_count；
+                # 仍在写入时下一轮会从同一位置重新提交，INSERT OR REPLACE 保证重复写入无害
+                st.session_state.pending_save = (st.session_state.current_chat_id, len(st.session_state.messages), future)
             # ---------------------------------------------------------
 
             # --- [C] 异步/延迟更新摘要 ---
             # 回答生成完后，默默更新一下摘要，为下一轮做准备
-            # 获取 LLM 引擎
-            _, _, _, generator = get_engine()
+            # 摘要提交到后台线程，结果在下一轮提问 (或分享) 时由 apply_pending_summary 合并
+            # 获取 LLM 引擎 (进程级缓存，只初始化 Generator)
+            generator = get_generator()
             
             # 找出所有尚未总结的消息 (包含刚才的 User Prompt 和 Assistant Response)
             new_msgs = st.session_state.messages[st.session_state.last_summarized_idx:]
             
-            # 如果累积了超过 2 轮对话 (4条消息)，就触发一次总结更新
-            # 这样可以减少 LLM 调用频率，不必每条都总结
-            if len(new_msgs) >= 2:
-                with st.status("📝 正在整理记忆...", expanded=False) as status:
-                    new_summary = recursive_summarize(generator, st.session_state.current_summary, new_msgs)
-                    st.session_state.current_summary = new_summary
-                    st.session_state.last_summarized_idx = len(st.session_state.messages)
-                    status.update(label="记忆已更新", state="complete", expanded=False)
+            # 按未总结文本量触发：累计超过 SUMMARY_CHAR_BUDGET 字符或攒够 SUMMARY_MAX_MSGS 条消息才总结一次；
+            # 上一次摘要还在后台运行时不重复提交，等它合并后下一轮再触发
+            needs_summary = st.session_state.unsummarized_chars > SUMMARY_CHAR_BUDGET or len(new_msgs) >= SUMMARY_MAX_MSGS
+            if needs_summary and "pending_summary" not in st.session_state:
+                future = get_summary_pool().submit(
+                    recursive_summarize,
+                    generator, st.session_state.current_summary, list(new_msgs),
+                    dialogue_lines=list(st.session_state.recent_context_buf)
+                )
+                st.session_state.pending_summary = (
+                    st.session_state.current_chat_id, len(st.session_state.messages), future
+                )
+
+            # 新对话第一次入库后整页刷新一次，让侧边栏历史列表出现这条记录
+            if is_new_chat:
+                st.rerun()
 
     # 3. 分享按钮
     if st.session_state.messages:
@@ -271,7 +477,8 @@ def chat_page(mode, use_graph):
         col1, col2 = st.columns([8, 2])
         with col2:
             if st.button("📤 分享到广场", use_container_width=True):
-                # A. 准备摘要
+                # A. 准备摘要 (先合并可能还在后台的摘要)
+                apply_pending_summary()
                 summary_to_share = st.session_state.current_summary
                 if not summary_to_share:
                     first_msg = st.session_state.messages[0]['content']
@@ -284,14 +491,17 @@ def chat_page(mode, use_graph):
                         chat_id=None,
                         username=st.session_state.username,
                         summary=summary_to_share,
-                        messages=st.session_state.messages
+                        new_messages=st.session_state.messages
                     )
                     st.session_state.current_chat_id = new_id
+                    st.session_state.saved_msg_count = len(st.session_state.messages)
+                    invalidate_history(st.session_state.username)
 
                 # C. 存入 Payload
                 st.session_state.share_payload = {
                     "summary": summary_to_share,
-                    "msgs": st.session_state.messages,
+                    # 广场只展示角色和正文，参考来源不随分享入库
+                    "msgs": [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
                     "mode": mode
                 }
                 
@@ -347,8 +557,8 @@ def share_confirm_page():
                 payload['msgs'], 
                 payload['mode']
             )
-            st.toast("🎉 发布成功！正在前往广场...")
-            time.sleep(1.5)
+            invalidate_square()
+            flash("🎉 发布成功！")
             # 清除 payload 释放内存
             del st.session_state.share_payload
             st.session_state.page = "square"
@@ -366,84 +576,115 @@ def square_page():
         st.rerun()
         
     st.header("✨ 灵感广场")
+    show_flash()
     
+    # 帖子和榜单一次查询取回；只取已加载的 feed_pages 页，需要时再 "加载更多"
+    limit = st.session_state.feed_pages * FEED_PAGE_SIZE
+    bundle = cached_square_bundle(limit)
+
     # 榜单
-    star_user, star_likes = get_academic_star()
+    star_user, star_likes = bundle["star"]
     if star_user != "暂无":
         st.info(f"🏆 本周学术之星: **{star_user}** (总获赞 {star_likes})")
     
-    posts = get_inspiration_posts()
+    posts = bundle["posts"]
     
     if not posts:
         st.write("广场暂时空空如也，快去分享你的第一个灵感吧！")
     
     current_user = st.session_state.username
+    # 当前用户已点赞的帖子：整页一次查询，卡片据此直接禁用点赞按钮
+    st.session_state.liked_posts = get_user_likes_in(current_user, [p[0] for p in posts])
 
-    for pid, post_owner, title, content_json, p_mode, likes in posts:
-        with st.container():
-            # 卡片样式
-            st.markdown(f"""
-            <div class="inspiration-card">
-                <h3>{title}</h3>
-                <p>👤 <b>{post_owner}</b> | 🏷️ 模式: {p_mode} | ❤️ {likes}</p>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # 判断是否是自己的帖子
-            is_my_post = (post_owner == current_user)
-            
-            # 布局调整：根据是否是自己的帖子，分配列宽
-            if is_my_post:
-                # 如果是自己的，分三栏：点赞(展示用) | 删除按钮 | 详情
-                col1, col2, col3 = st.columns([1.5, 1.5, 7])
-            else:
-                # 如果是别人的，分两栏：点赞按钮 | 详情
-                col1, col3 = st.columns([1.5, 8.5])
-                col2 = None
-
-            # --- 第一列：点赞 (功能相同) ---
-            with col1:
-                btn_label = f"❤️ ({likes})"
-                # 只有非本人才能点赞，且通过数据库校验
-                if st.button(btn_label, key=f"like_{pid}", use_container_width=True, disabled=is_my_post):
-                    if is_my_post:
-                        st.toast("不能给自己点赞哦", icon="🚫")
+    for post in posts:
+        post_card(post[0], current_user, limit)
+
+    # 取满了说明可能还有更多
+    if len(posts) == limit and st.button("加载更多", use_container_width=True):
+        st.session_state.feed_pages += 1
+        st.rerun()
+
+# 帖子卡片模板；标题和作者是用户输入，填入前统一转义
+_CARD_TPL = (
+    '<div class="inspiration-card">'
+    '<h3>{title}</h3>'
+    '<p>👤 <b>{owner}</b> | 🏷️ 模式: {mode} | ❤️ {likes}</p>'
+    '</div>'
+)
+
+# 每个帖子是一个独立 fragment：点赞只重跑被点击的这张卡片
+@st.fragment
+def post_card(pid, current_user, limit=FEED_PAGE_SIZE):
+    # 点赞后只重跑本卡片，提示在这里弹出
+    show_flash()
+    # 从缓存里取最新数据 (点赞后缓存已失效，这里会拿到新的点赞数)
+    post = next((p for p in cached_square_bundle(limit)["posts"] if p[0] == pid), None)
+    if post is None:
+        return
+    _, post_owner, title, p_mode, likes = post
+    # 乐观更新：自己刚点的赞先在本地计数，缓存过期重新查询后以数据库的值为准
+    likes = max(likes, st.session_state.get("like_floor", {}).get(pid, 0))
+
+    with st.container():
+        # 卡片样式 (st.html 直接渲染，不经过 Markdown 解析)
+        st.html(_CARD_TPL.format(
+            title=html.escape(title), owner=html.escape(post_owner),
+            mode=html.escape(p_mode or ""), likes=likes
+        ))
+        
+        # 判断是否是自己的帖子
+        is_my_post = (post_owner == current_user)
+        
+        # 布局调整：根据是否是自己的帖子，分配列宽
+        if is_my_post:
+            # 如果是自己的，分三栏：点赞(展示用) | 删除按钮 | 详情
+            col1, col2, col3 = st.columns([1.5, 1.5, 7])
+        else:
+            # 如果是别人的，分两栏：点赞按钮 | 详情
+            col1, col3 = st.columns([1.5, 8.5])
+            col2 = None
+
+        # --- 第一列：点赞 (功能相同) ---
+        with col1:
+            already_liked = pid in st.session_state.get("liked_posts", ())
+            btn_label = f"❤️ ({likes})"
+            # 只有非本人才能点赞，且通过数据库校验；已赞过的直接禁用，不用点了再被数据库拒绝
+            if st.button(btn_label, key=f"like_{pid}", use_container_width=True, disabled=is_my_post or already_liked):
+                if is_my_post:
+                    st.toast("不能给自己点赞哦", icon="🚫")
+                else:
+                    success, msg = like_post(pid, current_user)
+                    if success:
+                        # 不清空整个广场缓存 (所有人都要重新查询)，只在本地把这张卡片的计数 +1
+                        st.session_state.setdefault("like_floor", {})[pid] = likes + 1
+                        st.session_state.setdefault("liked_posts", set()).add(pid)
+                        flash(msg, balloons=True)
+                        st.rerun(scope="fragment")
                     else:
-                        success, msg = like_post(pid, current_user)
-                        if success:
-                            st.balloons()
-                            st.toast(msg)
-                            time.sleep(1)
-                            st.rerun()
-                        else:
-                            st.toast(msg, icon="🚫")
-
-            # --- 第二列：删除 (仅作者可见) ---
-            if is_my_post and col2:
-                with col2:
-                    # 使用红色按钮区分
-                    if st.button("🗑️ 删除", key=f"del_share_{pid}", type="primary", use_container_width=True):
-                        if delete_shared_chat(pid, current_user):
-                            st.toast("已删除你的分享", icon="✅")
-                            time.sleep(1)
-                            st.rerun()
-                        else:
-                            st.error("删除失败，可能权限不足")
-
-            # --- 第三列：详情展开 ---
-            with col3:
-                with st.expander("查看对话详情"):
-                    try:
-                        chat_data = json.loads(content_json)
-                        for msg in chat_data:
-                            role_icon = "🧑‍💻" if msg['role'] == "user" else "🤖"
-                            # 限制一下过长的内容显示
-                            content_display = msg['content']
-                            st.markdown(f"**{role_icon} {msg['role']}**: {content_display}")
-                    except:
-                        st.error("数据解析失败")
-            
-            st.divider()
+                        st.toast(msg, icon="🚫")
+
+        # --- 第二列：删除 (仅作者可见) ---
+        if is_my_post and col2:
+            with col2:
+                # 使用红色按钮区分
+                if st.button("🗑️ 删除", key=f"del_share_{pid}", type="primary", use_container_width=True):
+                    if delete_shared_chat(pid, current_user):
+                        invalidate_square()
+                        flash("已删除你的分享", icon="✅")
+                        st.rerun()
+                    else:
+                        st.error("删除失败，可能权限不足")
+
+        # --- 第三列：详情展开 ---
+        with col3:
+            # 用开关而不是 expander (折叠时内容也会执行)：只有点开时才读取并渲染详情
+            if st.toggle("查看对话详情", key=f"detail_{pid}"):
+                try:
+                    st.markdown(_post_detail_markdown(pid))
+                except:
+                    st.error("数据解析失败")
+        
+        st.divider()
 
 # 个人中心
 def profile_page():
@@ -464,7 +705,7 @@ def profile_page():
     try:
         # 获取真实的历史记录列表
         # 注意: db.py 中该函数默认 LIMIT 20，这里显示的是最近的记录数
-        history_list = get_private_history_list(st.session_state.username)
+        history_list = cached_history_list(st.session_state.username)
         real_count = len(history_list)
         
         col1, col2 = st.columns([1, 3])
@@ -490,11 +731,11 @@ def main():
         login_page()
     else:
         # 1. 渲染侧边栏 (始终显示)
-        mode, use_graph = sidebar()
+        sidebar()
         
         # 2. 页面路由分发 (Routing)
         if st.session_state.page == "chat":
-            chat_page(mode, use_graph)
+            chat_page()
             
         elif st.session_state.page == "square":
             square_page()
@@ -1,224 +1,407 @@
 # ui/db.py
 import sqlite3
+import atexit
 import hashlib
+import hmac
+import os
 import json
+import threading
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
 
 DB_PATH = "data/scholar_ui.db"
+# 数据迁移版本号 (存于 PRAGMA user_version)
+SCHEMA_VERSION = 2
+
+# JSON 编解码优先用 orjson (C 实现，长消息编解码快得多)，未安装时退回标准库
+# 两种实现输出一致：紧凑分隔符、中文不转义
+try:
+    import orjson
+
+    def jdumps(obj):
+        return orjson.dumps(obj).decode()
+
+    jloads = orjson.loads
+except ImportError:
+    def jdumps(obj):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+    jloads = json.loads
+
+# 分享内容压缩存储：整段对话 JSON 经 zlib 压缩后以 BLOB 入库，体积约为原来的 1/3
+def pack_content(obj):
+    return zlib.compress(jdumps(obj).encode("utf-8"), 6)
+
+def unpack_content(value):
+    """解出分享内容；兼容压缩前以 TEXT 存储的旧数据"""
+    if isinstance(value, bytes):
+        value = zlib.decompress(value)
+    return jloads(value)
+
+# 进程内共享一个 SQLite 连接，所有调用复用，退出时关闭
+# WAL 让读写互不阻塞，synchronous=NORMAL 在 WAL 下只在检查点时 fsync
+# Streamlit 每次 rerun 在不同线程执行，后台写库也在单独线程，所以用锁串行使用这个连接
+_conn = None
+_conn_lock = threading.RLock()
+
+@contextmanager
+def _db():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            # isolation_level=None：sqlite3 不隐式开事务，单条写入自动提交，多条写入用 _tx 显式包成一个事务
+            _conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            # 连接级调优：临时表放内存，64MB 页缓存，256MB 内存映射读，写锁冲突时最多等 10 秒
+            _conn.execute("PRAGMA temp_store=MEMORY")
+            _conn.execute("PRAGMA cache_size=-64000")
+            _conn.execute("PRAGMA mmap_size=268435456")
+            _conn.execute("PRAGMA busy_timeout=10000")
+        try:
+            yield _conn
+        except Exception:
+            # 出错时回滚未提交的写入，避免残留事务污染下一个调用方
+            _conn.rollback()
+            raise
+
+# 显式写事务：BEGIN IMMEDIATE 一开始就拿写锁，多条写入只提交 (fsync) 一次；出错整体回滚
+@contextmanager
+def _tx(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+# 进程退出时关闭连接，让 WAL 检查点落盘
+@atexit.register
+def _close_db():
+    if _conn is not None:
+        _conn.close()
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY, password TEXT, created_at TEXT)''')
+    with _db() as conn:
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS users
+                     (username TEXT PRIMARY KEY, password TEXT, created_at TEXT)''')
     
-    # 私人历史表
-    c.execute('''CREATE TABLE IF NOT EXISTS private_chats
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  username TEXT, 
-                  summary TEXT, 
-                  messages JSON, 
-                  updated_at TEXT)''')
-
-    # 灵感广场表
-    c.execute('''CREATE TABLE IF NOT EXISTS shared_chats
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  username TEXT, 
-                  title TEXT, 
-                  content JSON, 
-                  mode TEXT,
-                  likes INTEGER DEFAULT 0,
-                  created_at TEXT)''')
+        # 私人历史表
+        c.execute('''CREATE TABLE IF NOT EXISTS private_chats
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                      username TEXT, 
+                      summary TEXT, 
+                      messages JSON, 
+                      updated_at TEXT)''')
+
+        # 灵感广场表
+        c.execute('''CREATE TABLE IF NOT EXISTS shared_chats
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                      username TEXT, 
+                      title TEXT, 
+                      content JSON, 
+                      mode TEXT,
+                      likes INTEGER DEFAULT 0,
+                      created_at TEXT)''')
     
-    # [新增] 点赞记录表：用于记录谁给哪个帖子点了赞
-    # 联合主键 (username, post_id) 确保每人对每贴只能点赞一次
-    c.execute('''CREATE TABLE IF NOT EXISTS post_likes
-                 (username TEXT, 
-                  post_id INTEGER, 
-                  created_at TEXT,
-                  PRIMARY KEY (username, post_id))''')
+        # [新增] 点赞记录表：用于记录谁给哪个帖子点了赞
+        # 联合主键 (username, post_id) 确保每人对每贴只能点赞一次
+        c.execute('''CREATE TABLE IF NOT EXISTS post_likes
+                     (username TEXT, 
+                      post_id INTEGER, 
+                      created_at TEXT,
+                      PRIMARY KEY (username, post_id))''')
+
+        # 对话消息表：每条消息一行，每轮只追加新消息
+        c.execute('''CREATE TABLE IF NOT EXISTS chat_messages
+                     (chat_id INTEGER, 
+                      seq INTEGER, 
+                      role TEXT, 
+                      content TEXT, 
+                      sources JSON,
+                      PRIMARY KEY (chat_id, seq))''')
+
+        # 索引：覆盖热点查询，避免每次全表扫描 + 排序
+        # 广场按点赞数分页 (带 id 兜底排序，索引顺序与 ORDER BY 完全一致，免去临时排序)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_shared_likes_id ON shared_chats(likes DESC, id DESC)")
+        # 删帖触发器按用户检查是否还有其他帖子 (不含 likes，点赞更新无需改写该索引)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_shared_user ON shared_chats(username)")
+        # 删帖时按 post_id 清理点赞记录 (主键以 username 开头，用不上)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_post ON post_likes(post_id)")
+        # 侧边栏历史列表：按用户取最近更新的对话
+        c.execute("CREATE INDEX IF NOT EXISTS idx_private_user_updated ON private_chats(username, updated_at DESC)")
 
-    conn.commit()
-    conn.close()
+        # 用户总获赞数汇总表：由触发器随 shared_chats 增量维护，学术之星直接按索引取第一名
+        c.execute('''CREATE TABLE IF NOT EXISTS user_totals
+                     (username TEXT PRIMARY KEY, 
+                      total_likes INTEGER DEFAULT 0)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_user_totals_likes ON user_totals(total_likes DESC)")
+        c.execute('''CREATE TRIGGER IF NOT EXISTS trg_shared_insert_totals AFTER INSERT ON shared_chats
+                     BEGIN
+                         INSERT INTO user_totals (username, total_likes) VALUES (NEW.username, NEW.likes)
+                         ON CONFLICT(username) DO UPDATE SET total_likes = total_likes + NEW.likes;
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS trg_shared_likes_totals AFTER UPDATE OF likes ON shared_chats
+                     BEGIN
+                         UPDATE user_totals SET total_likes = total_likes + (NEW.likes - OLD.likes)
+                         WHERE username = NEW.username;
+                     END''')
+        # 删帖后扣掉该帖的赞；用户已没有任何帖子时移出榜单 (与原 GROUP BY 的结果一致)
+        c.execute('''CREATE TRIGGER IF NOT EXISTS trg_shared_delete_totals AFTER DELETE ON shared_chats
+                     BEGIN
+                         UPDATE user_totals SET total_likes = total_likes - OLD.likes WHERE username = OLD.username;
+                         DELETE FROM user_totals WHERE username = OLD.username
+                             AND NOT EXISTS (SELECT 1 FROM shared_chats WHERE username = OLD.username);
+                     END''')
+        # 删帖时级联清理点赞记录 (触发器与 DELETE 同一语句内执行，天然原子)
+        c.execute('''CREATE TRIGGER IF NOT EXISTS trg_shared_delete_likes AFTER DELETE ON shared_chats
+                     BEGIN
+                         DELETE FROM post_likes WHERE post_id = OLD.id;
+                     END''')
 
-def hash_pass(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+        # 用 PRAGMA user_version 记录已完成的迁移，迁移过的库启动时只读一次文件头
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            legacy = []
+            if version < 1:
+                # 一次性迁移：旧版 private_chats.messages 中的整段 JSON 拆分为逐条消息
+                c.execute("SELECT id, messages FROM private_chats WHERE messages IS NOT NULL")
+                legacy = c.fetchall()
+            with _tx(conn):
+                for chat_id, messages_json in legacy:
+                    c.executemany("INSERT OR IGNORE INTO chat_messages (chat_id, seq, role, content, sources) VALUES (?, ?, ?, ?, ?)",
+                                  _message_rows(chat_id, 0, jloads(messages_json)))
+                    c.execute("UPDATE private_chats SET messages=NULL WHERE id=?", (chat_id,))
+                if version < 2:
+                    # 回填一次已有帖子的获赞汇总，之后交给触发器维护
+                    c.execute("DELETE FROM user_totals")
+                    c.execute("INSERT INTO user_totals (username, total_likes) SELECT username, SUM(likes) FROM shared_chats GROUP BY username")
+                c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def _message_rows(chat_id, start_seq, messages):
+    """把消息字典转换为 chat_messages 的行"""
+    return [(chat_id, start_seq + i, m['role'], m['content'],
+             jdumps(m['sources']) if m.get('sources') else None)
+            for i, m in enumerate(messages)]
+
+# 每轮对话、每次登录、每次刷新侧边栏都会执行的语句，统一提为模块常量
+_SQL_UPSERT_MESSAGES = "INSERT OR REPLACE INTO chat_messages (chat_id, seq, role, content, sources) VALUES (?, ?, ?, ?, ?)"
+_SQL_LOGIN = "SELECT password FROM users WHERE username=?"
+_SQL_HISTORY_LIST = "SELECT id, summary, updated_at FROM private_chats WHERE username=? ORDER BY updated_at DESC LIMIT 20"
+
+def _load_messages(c, chat_ids):
+    """批量读取多段对话的消息，返回 {chat_id: [message, ...]}"""
+    result = {cid: [] for cid in chat_ids}
+    if not chat_ids:
+        return result
+    placeholders = ",".join("?" * len(chat_ids))
+    c.execute(f"SELECT chat_id, role, content, sources FROM chat_messages WHERE chat_id IN ({placeholders}) ORDER BY chat_id, seq",
+              list(chat_ids))
+    for chat_id, role, content, sources in c.fetchall():
+        msg = {"role": role, "content": content}
+        if sources:
+            msg["sources"] = jloads(sources)
+        result[chat_id].append(msg)
+    return result
+
+# 密码用 scrypt 派生 (每个用户独立随机盐)，存储格式: scrypt$盐(hex)$哈希(hex)
+# 旧账号的无盐 sha256 仍可登录，登录成功后自动升级为 scrypt
+SCRYPT_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1}
+
+def hash_pass(password, salt=None):
+    salt = salt or os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+    return f"scrypt${salt.hex()}${digest.hex()}"
+
+def verify_pass(password, stored):
+    if stored.startswith("scrypt$"):
+        _, salt_hex, _ = stored.split("$")
+        candidate = hash_pass(password, bytes.fromhex(salt_hex))
+    else:
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+    # 常量时间比较，避免计时侧信道
+    return hmac.compare_digest(candidate, stored)
 
 def register_user(username, password):
+    # KDF 计算放在锁外，不阻塞其他会话的数据库操作
+    hashed = hash_pass(password)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("INSERT INTO users VALUES (?, ?, ?)", 
-                  (username, hash_pass(password), datetime.now().isoformat()))
-        conn.commit()
-        conn.close()
+        with _db() as conn:
+            c = conn.cursor()
+            c.execute("INSERT INTO users VALUES (?, ?, ?)", 
+                      (username, hashed, datetime.now().isoformat()))
         return True
     except sqlite3.IntegrityError:
         return False
 
 def login_user(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT password FROM users WHERE username=?", (username,))
-    res = c.fetchone()
-    conn.close()
-    if res and res[0] == hash_pass(password):
-        return True
-    return False
+    with _db() as conn:
+        c = conn.cursor()
+        c.execute(_SQL_LOGIN, (username,))
+        res = c.fetchone()
+    if not (res and verify_pass(password, res[0])):
+        return False
+    if not res[0].startswith("scrypt$"):
+        upgraded = hash_pass(password)
+        with _db() as conn:
+            conn.execute("UPDATE users SET password=? WHERE username=?", (upgraded, username))
+    return True
 
 # [新增] 保存私人历史
 def save_private_chat(username, summary, messages):
     if not messages: return
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO private_chats (username, summary, messages, updated_at) VALUES (?, ?, ?, ?)",
-              (username, summary, json.dumps(messages), datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    save_or_update_chat(None, username, summary, messages)
 
 # [新增] 获取用户的历史列表 (按时间倒序)
 def get_private_history_list(username):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, summary, messages, updated_at FROM private_chats WHERE username=? ORDER BY updated_at DESC LIMIT 20", (username,))
-    rows = c.fetchall()
-    conn.close()
-    # 返回格式: [{"id":..., "summary":..., "msgs":...}]
-    return [{"id": r[0], "summary": r[1], "msgs": json.loads(r[2])} for r in rows]
+    with _db() as conn:
+        c = conn.cursor()
+        # 列表只取元信息，消息内容等用户点开某段对话时再按 ID 读取
+        c.execute(_SQL_HISTORY_LIST, (username,))
+        rows = c.fetchall()
+        # 返回格式: [{"id":..., "summary":..., "updated_at":...}]
+        return [{"id": r[0], "summary": r[1], "updated_at": r[2]} for r in rows]
+
+# 读取单段对话的全部消息 (加载历史对话时调用)
+def get_private_chat_messages(chat_id):
+    with _db() as conn:
+        return _load_messages(conn.cursor(), [chat_id])[chat_id]
 
 def share_chat_to_square(username, title, chat_history, mode):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO shared_chats (username, title, content, mode, created_at) VALUES (?, ?, ?, ?, ?)",
-              (username, title, json.dumps(chat_history), mode, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
-
-def get_inspiration_posts():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # 按点赞数倒序
-    c.execute("SELECT id, username, title, content, mode, likes FROM shared_chats ORDER BY likes DESC LIMIT 20")
-    posts = c.fetchall()
-    conn.close()
-    return posts
-
-def save_or_update_chat(chat_id, username, summary, messages):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # 确保 summary 不为空，否则历史列表很难看
-    if not summary: summary = "新对话..."
+    with _db() as conn:
+        c = conn.cursor()
+        # 紧凑 JSON + 中文不转义，再经 zlib 压缩，入库体积更小
+        content = pack_content(chat_history)
+        c.execute("INSERT INTO shared_chats (username, title, content, mode, created_at) VALUES (?, ?, ?, ?, ?)",
+                  (username, title, content, mode, datetime.now().isoformat()))
+
+# 热点 SQL 为模块常量：语句文本固定，命中 sqlite3 的预编译语句缓存。
+# 广场列表只取卡片需要的字段 (不带 content)，详情按 ID 单独读取
+_SQL_FEED_PAGE = ("SELECT id, username, title, mode, likes FROM shared_chats "
+                  "ORDER BY likes DESC, id DESC LIMIT ?")
+# 帖子归属 (点赞失败时区分原因)
+_SQL_POST_OWNER = "SELECT username FROM shared_chats WHERE id=?"
+# 点赞：帖子存在且不是本人时插入，已赞过 (主键冲突) 则忽略
+_SQL_LIKE_INSERT = ("INSERT OR IGNORE INTO post_likes (username, post_id, created_at) "
+                    "SELECT ?, ?, ? FROM shared_chats WHERE id=? AND username<>?")
+# 学术之星读触发器维护的汇总表 (user_totals)
+_SQL_ACADEMIC_STAR = "SELECT username, total_likes FROM user_totals ORDER BY total_likes DESC LIMIT 1"
+
+# 广场每页条数。"加载更多" 只增大 LIMIT (已加载页数 × 每页条数)，每次从第一条取起，
+# 已加载的范围来自同一次查询，点赞数变化时不会在页与页之间重复或漏掉帖子
+FEED_PAGE_SIZE = 20
+
+def get_inspiration_posts(limit=FEED_PAGE_SIZE):
+    with _db() as conn:
+        c = conn.cursor()
+        # 按点赞数倒序；id 兜底保证排序稳定
+        c.execute(_SQL_FEED_PAGE, (limit,))
+        posts = c.fetchall()
+        return posts
+
+# 单个帖子的对话内容 (压缩后的原始值，用 unpack_content 解码)；帖子不存在时返回 None
+def get_post_content(post_id):
+    with _db() as conn:
+        row = conn.execute("SELECT content FROM shared_chats WHERE id=?", (post_id,)).fetchone()
+        return row[0] if row else None
+
+def save_or_update_chat(chat_id, username, summary, new_messages, start_seq=0):
+    """
+    更新对话摘要，并追加新消息。
+    new_messages: 本次新增的消息 (不是完整历史)，从序号 start_seq 开始写入
+    返回: 对话 ID (新建时为数据库生成的 ID)
+    """
+    with _db() as conn:
+        c = conn.cursor()
+        # 确保 summary 不为空，否则历史列表很难看
+        if not summary: summary = "新对话..."
     
-    if chat_id is None:
-        c.execute("INSERT INTO private_chats (username, summary, messages, updated_at) VALUES (?, ?, ?, ?)",
-                  (username, summary, json.dumps(messages), datetime.now().isoformat()))
-        new_id = c.lastrowid
-        conn.commit()
-        conn.close()
-        return new_id
-    else:
-        c.execute("UPDATE private_chats SET summary=?, messages=?, updated_at=? WHERE id=?",
-                  (summary, json.dumps(messages), datetime.now().isoformat(), chat_id))
-        conn.commit()
-        conn.close()
+        with _tx(conn):
+            if chat_id is None:
+                c.execute("INSERT INTO private_chats (username, summary, updated_at) VALUES (?, ?, ?)",
+                          (username, summary, datetime.now().isoformat()))
+                chat_id = c.lastrowid
+            else:
+                c.execute("UPDATE private_chats SET summary=?, updated_at=? WHERE id=?",
+                          (summary, datetime.now().isoformat(), chat_id))
+                # 对话已被删除 (后台保存排队期间用户点了删除)：不再写入消息，避免留下孤立记录
+                if c.rowcount == 0:
+                    return chat_id
+
+            # 只写入本轮新增的消息
+            c.executemany(_SQL_UPSERT_MESSAGES, _message_rows(chat_id, start_seq, new_messages))
         return chat_id
     
 # [新增] 根据 ID 删除指定的对话记录
 def delete_private_chat(chat_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM private_chats WHERE id=?", (chat_id,))
-    conn.commit()
-    conn.close()
-
+    with _db() as conn:
+        c = conn.cursor()
+        with _tx(conn):
+            c.execute("DELETE FROM private_chats WHERE id=?", (chat_id,))
+            c.execute("DELETE FROM chat_messages WHERE chat_id=?", (chat_id,))
 
-def share_chat_to_square(username, title, chat_history, mode):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO shared_chats (username, title, content, mode, created_at) VALUES (?, ?, ?, ?, ?)",
-              (username, title, json.dumps(chat_history), mode, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
-
-def get_inspiration_posts():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, username, title, content, mode, likes FROM shared_chats ORDER BY likes DESC LIMIT 20")
-    posts = c.fetchall()
-    conn.close()
-    return posts
 
 # [重写] 点赞逻辑：增加权限检查
 def like_post(post_id, username):
     """
     返回: (Success: bool, Message: str)
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 1. 检查帖子归属
-    c.execute("SELECT username FROM shared_chats WHERE id=?", (post_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        return False, "帖子不存在"
-    
-    owner = row[0]
-    if owner == username:
-        conn.close()
-        return False, "不能给自己点赞 (保持谦虚!)"
-    
-    # 2. 检查是否已点赞
-    c.execute("SELECT 1 FROM post_likes WHERE username=? AND post_id=?", (username, post_id))
-    if c.fetchone():
-        conn.close()
+    with _db() as conn:
+        c = conn.cursor()
+
+        # 归属检查 + 去重 + 写入是一条语句：帖子存在、不是自己的、没赞过才会插入一行
+        # 两条写入同一事务，成功时一次提交，失败时整体回滚 (共享连接上不能留半截事务)
+        try:
+            with _tx(conn):
+                c.execute(_SQL_LIKE_INSERT, (username, post_id, datetime.now().isoformat(), post_id, username))
+                inserted = c.rowcount == 1
+                if inserted:
+                    # 增加计数
+                    c.execute("UPDATE shared_chats SET likes = likes + 1 WHERE id=?", (post_id,))
+        except Exception as e:
+            return False, f"点赞失败: {e}"
+
+        if inserted:
+            return True, "❤️ 点赞成功！"
+
+        # 只有失败时才再查一次，区分具体原因
+        row = c.execute(_SQL_POST_OWNER, (post_id,)).fetchone()
+        if not row:
+            return False, "帖子不存在"
+        if row[0] == username:
+            return False, "不能给自己点赞 (保持谦虚!)"
         return False, "你已经点过赞了"
 
-    # 3. 执行点赞 (事务)
-    try:
-        # 记录点赞人
-        c.execute("INSERT INTO post_likes (username, post_id, created_at) VALUES (?, ?, ?)", 
-                  (username, post_id, datetime.now().isoformat()))
-        # 增加计数
-        c.execute("UPDATE shared_chats SET likes = likes + 1 WHERE id=?", (post_id,))
-        conn.commit()
-        msg = "❤️ 点赞成功！"
-        success = True
-    except Exception as e:
-        msg = f"点赞失败: {e}"
-        success = False
-        
-    conn.close()
-    return success, msg
-
-def get_academic_star():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT username, SUM(likes) as total_likes FROM shared_chats GROUP BY username ORDER BY total_likes DESC LIMIT 1")
-    res = c.fetchone()
-    conn.close()
-    return res if res else ("暂无", 0)
+# 一次 IN 查询取出用户在这批帖子里点过赞的 ID (走 (username, post_id) 主键)
+def get_user_likes_in(username, post_ids):
+    if not post_ids:
+        return set()
+    with _db() as conn:
+        placeholders = ",".join("?" * len(post_ids))
+        rows = conn.execute(f"SELECT post_id FROM post_likes WHERE username=? AND post_id IN ({placeholders})",
+                            [username, *post_ids]).fetchall()
+    return {r[0] for r in rows}
+
+# 灵感广场一次取齐：前 limit 条帖子 + 学术之星，共用一个连接
+def get_square_bundle(limit=FEED_PAGE_SIZE):
+    with _db() as conn:
+        c = conn.cursor()
+        posts = get_inspiration_posts(limit)
+        c.execute(_SQL_ACADEMIC_STAR)
+        star = c.fetchone()
+        return {"posts": posts, "star": star if star else ("暂无", 0)}
 
 def delete_shared_chat(post_id, username):
     """
     删除分享的帖子。
     安全检查：只有当帖子属于 username 时才执行删除。
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 1. 验证归属权
-    c.execute("SELECT username FROM shared_chats WHERE id=?", (post_id,))
-    row = c.fetchone()
-    
-    success = False
-    if row and row[0] == username:
-        # 2. 删除帖子
-        c.execute("DELETE FROM shared_chats WHERE id=?", (post_id,))
-        # 3. (可选) 删除关联的点赞记录，保持数据整洁
-        c.execute("DELETE FROM post_likes WHERE post_id=?", (post_id,))
-        conn.commit()
-        success = True
-    
-    conn.close()
-    return success
\ No newline at end of file
+    with _db() as conn:
+        c = conn.cursor()
+        # 归属校验写在 WHERE 里，一条语句完成，没有 "先查后删" 的竞态；
+        # 点赞记录和获赞汇总由 shared_chats 上的触发器同步清理
+        c.execute("DELETE FROM shared_chats WHERE id=? AND username=?", (post_id, username))
+        return c.rowcount == 1
\ No newline at end of file
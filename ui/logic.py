@@ -13,19 +13,29 @@ from src.core.generator import ReviewGenerator
 from src.config import settings
 
 # 使用 Streamlit 缓存机制，避免每次刷新都重新初始化模型
+# 每个组件单独缓存：只需要 LLM 的路径 (如摘要) 不会连带初始化向量库
 @st.cache_resource
-def get_engine():
-    retriever = OpenAlexRetriever()
-    local_store = LocalVectorStore()
-    expander = ConceptExpander()
-    generator = ReviewGenerator()
-    return retriever, local_store, expander, generator
-
-def recursive_summarize(generator, current_summary, new_messages):
+def get_retriever():
+    return OpenAlexRetriever()
+
+@st.cache_resource
+def get_local_store():
+    return LocalVectorStore()
+
+@st.cache_resource
+def get_expander():
+    return ConceptExpander()
+
+@st.cache_resource
+def get_generator():
+    return ReviewGenerator()
+
+def recursive_summarize(generator, current_summary, new_messages, dialogue_lines=None):
     """
     输入:
     - current_summary: 之前的摘要 (String)
     - new_messages: 尚未被总结的新对话 (List[Dict])
+    - dialogue_lines: 可选，new_messages 已格式化好的 "role: content" 行，传入则直接复用
     
     输出:
     - new_summary: 更新后的摘要
@@ -34,7 +44,9 @@ def recursive_summarize(generator, current_summary, new_messages):
         return current_summary
 
     # 将新对话格式化为文本
-    new_dialogue = "\n".join([f"{m['role']}: {m['content']}" for m in new_messages])
+    if dialogue_lines is None:
+        dialogue_lines = (f"{m['role']}: {m['content']}" for m in new_messages)
+    new_dialogue = "\n".join(dialogue_lines)
     
     # 构造 Prompt：基于旧摘要 + 新增量 -> 更新摘要
     if current_summary:
@@ -68,32 +80,52 @@ def recursive_summarize(generator, current_summary, new_messages):
         return current_summary # 失败则返回旧的，防止丢失
 
 
-def process_query(query, mode, use_graph, history_context_str):
-    """
-    注意：现在的 process_query 不再负责维护历史，它只负责回答当前问题。
-    历史维护逻辑上移到 app.py 中。
-    
-    query: 当前问题
-    history_context_str: 已经被 app.py 处理好的、包含摘要的上下文字符串
-    """
-    retriever, local_store, expander, generator = get_engine()
-    
+class _NoPapers(Exception):
+    """检索没有结果 (或请求失败)：以异常退出，st.cache_data 不会缓存这次结果"""
+
+# 概念扩展 + OpenAlex 检索：相同问题 (如追问建议被重复点击) 在 10 分钟内直接复用论文列表
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def search_papers(query, use_graph):
+    retriever, expander = get_retriever(), get_expander()
+
     # 1. 广度搜索
     concept_ids = None
     if use_graph:
         info = expander.expand_query(query)
         if info:
             concept_ids = [info['id']]
-    
+
     # 2. OpenAlex
     papers = retriever.search(query, top_k=settings.RAG_DOWNLOAD_K, concept_ids=concept_ids)
+
     if not papers:
-        # 即使没有新论文，也可以基于历史回答，所以不要直接 return
-        pass 
+        raise _NoPapers(query)
+    return papers
 
-    # 3. 入库
-    if papers:
-        local_store.add_papers(papers)
+def fetch_and_ingest(query, use_graph):
+    try:
+        papers = search_papers(query, use_graph)
+    except _NoPapers:
+        return []
+    # 3. 入库 (不缓存)：已入库的论文由增量检查直接跳过，上次下载或向量化失败的论文在这里重试
+    get_local_store().add_papers(papers)
+    return papers
+
+
+def process_query(query, mode, use_graph, history_context_str, stream=False):
+    """
+    注意：现在的 process_query 不再负责维护历史，它只负责回答当前问题。
+    历史维护逻辑上移到 app.py 中。
+    
+    query: 当前问题
+    history_context_str: 已经被 app.py 处理好的、包含摘要的上下文字符串
+    stream: 为 True 时 response 是逐段产出文本的生成器 (检索在返回前已完成)
+    """
+    local_store, generator = get_local_store(), get_generator()
+    
+    # 1~3. 广度搜索 + OpenAlex + 入库 (相同问题在缓存有效期内直接复用)
+    # 即使没有新论文，也可以基于历史回答，所以不要直接 return
+    papers = fetch_and_ingest(query, use_graph)
     
     # 4. 深度召回
     chunks = local_store.search(query, top_k=settings.RAG_RETRIEVAL_K)
@@ -108,6 +140,9 @@ def process_query(query, mode, use_graph, history_context_str):
     {query}
     """
     
-    response = generator.generate(augmented_query, chunks, task_type=mode)
+    if stream:
+        response = generator.generate_stream(augmented_query, chunks, task_type=mode)
+    else:
+        response = generator.generate(augmented_query, chunks, task_type=mode)
     
     return response, papers
\ No newline at end of file